@@ -1,6 +1,7 @@
 import pandas as pd
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -13,54 +14,58 @@ csv_files = [
     "public/data/themis_lat30_lon000_craters.csv"  # Add your actual file paths here
 ]
 
-# Initialize an empty DataFrame to store aggregated statistics
-all_stats = []
+def load(csv_file):
+    """Load one crater CSV, tagging rows with the lat, lon parsed from the filename."""
+    df = pd.read_csv(csv_file, engine='pyarrow')
+    
+    # Extract lat, lon from filename for context
+    filename = os.path.basename(csv_file)
+    lat_str = filename.split('lat')[1].split('_')[0]
+    lon_str = filename.split('lon')[1].split('_')[0]
+    df['latitude'] = int(lat_str)
+    df['longitude'] = int(lon_str)
+    logger.info(f"Loaded {csv_file} with {len(df)} craters")
+    return df
 
+# Check which CSV files exist
+existing_files = []
 for csv_file in csv_files:
-    # Check if the CSV file exists
     if os.path.exists(csv_file):
-        # Load the CSV file
-        df = pd.read_csv(csv_file)
-        
-        # Extract lat, lon from filename for context
-        filename = os.path.basename(csv_file)
-        lat_str = filename.split('lat')[1].split('_')[0]
-        lon_str = filename.split('lon')[1].split('_')[0]
-        lat = int(lat_str)
-        lon = int(lon_str)
-        df['latitude'] = lat
-        df['longitude'] = lon
-        logger.info(f"Loaded {csv_file} with {len(df)} craters")
-        
-        # Calculate aggregated statistics
-        mean_stats = {
-            'total_craters': len(df),
-            'mean_diameter_km': df['diameter_km'].mean(),
-            'median_diameter_km': df['diameter_km'].median(),
-            'min_diameter_km': df['diameter_km'].min(),
-            'max_diameter_km': df['diameter_km'].max(),
-            'mean_depth_km': df['depth_km'].mean(),
-            'median_depth_km': df['depth_km'].median(),
-            'min_depth_km': df['depth_km'].min(),
-            'max_depth_km': df['depth_km'].max(),
-            'mean_circularity': df['circularity'].mean()
-        }
-        
-        # Append the statistics to the list
-        all_stats.append(mean_stats)
-        
-        # Log the results
-        logger.info("\nAggregated Mean Statistics (kilometers):")
-        for key, value in mean_stats.items():
-            if isinstance(value, float):
-                logger.info(f"{key}: {value:.2f} km")
-            else:
-                logger.info(f"{key}: {value}")
+        existing_files.append(csv_file)
     else:
         logger.error(f"CSV file not found: {csv_file}")
 
+# Load the CSV files concurrently; parsing releases the GIL
+with ThreadPoolExecutor(max_workers=8) as executor:
+    dfs = list(executor.map(load, existing_files))
+
+# Calculate aggregated statistics for every tile in a single groupby pass
+if dfs:
+    mean_stats_df = pd.concat(dfs, ignore_index=True).groupby(['latitude', 'longitude'], sort=False).agg(
+        total_craters=('diameter_km', 'size'),
+        mean_diameter_km=('diameter_km', 'mean'),
+        median_diameter_km=('diameter_km', 'median'),
+        min_diameter_km=('diameter_km', 'min'),
+        max_diameter_km=('diameter_km', 'max'),
+        mean_depth_km=('depth_km', 'mean'),
+        median_depth_km=('depth_km', 'median'),
+        min_depth_km=('depth_km', 'min'),
+        max_depth_km=('depth_km', 'max'),
+        mean_circularity=('circularity', 'mean')
+    ).reset_index()
+else:
+    mean_stats_df = pd.DataFrame()
+
+# Log the results
+for mean_stats in mean_stats_df.to_dict('records'):
+    logger.info("\nAggregated Mean Statistics (kilometers):")
+    for key, value in mean_stats.items():
+        if isinstance(value, float):
+            logger.info(f"{key}: {value:.2f} km")
+        else:
+            logger.info(f"{key}: {value}")
+
 # Save aggregated statistics to a CSV file
 output_file = "public/data/mean_stats_summary.csv"
-mean_stats_df = pd.DataFrame(all_stats)
 mean_stats_df.to_csv(output_file, index=False)
 logger.info(f"Saved aggregated stats to {output_file}")
\ No newline at end of file
@@ -1,5 +1,7 @@
 import numpy as np
 import pymeshlab as ml
+import trimesh
+from numba import njit, prange
 from scipy.ndimage import zoom
 from pathlib import Path
 import logging
@@ -15,12 +17,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@njit(parallel=True, fastmath=True, cache=True)
+def build_mesh(heightmap, max_value, scale_factor):
+    """Build float32 vertices and int32 faces for a heightmap grid in one pass."""
+    height, width = heightmap.shape
+    vertices = np.empty((height * width, 3), dtype=np.float32)
+    faces = np.empty((2 * (height - 1) * (width - 1), 3), dtype=np.int32)
+    
+    # Same spacing as np.linspace(-n/2, n/2, n)
+    x_step = width / (width - 1) if width > 1 else 0.0
+    y_step = height / (height - 1) if height > 1 else 0.0
+    z_scale = scale_factor / max_value
+    
+    # X coordinates are shared by every row, so compute them once
+    xs = ((np.arange(width) * x_step - width / 2) * scale_factor).astype(np.float32)
+    
+    for i in prange(height):
+        y = (-height / 2 + i * y_step) * scale_factor
+        for j in range(width):
+            v0 = i * width + j
+            vertices[v0, 0] = xs[j]
+            vertices[v0, 1] = heightmap[i, j] * z_scale  # Height becomes Y in 3D space
+            vertices[v0, 2] = y  # Swap Y and Z for proper orientation
+            
+            # Two triangles per grid quad
+            if i < height - 1 and j < width - 1:
+                f = 2 * (i * (width - 1) + j)
+                v2 = v0 + width
+                faces[f, 0] = v0
+                faces[f, 1] = v2
+                faces[f, 2] = v0 + 1
+                faces[f + 1, 0] = v0 + 1
+                faces[f + 1, 1] = v2
+                faces[f + 1, 2] = v2 + 1
+    
+    return vertices, faces
+
 class MemoryOptimizedConverter:
     def __init__(self, chunk_size=1024):
         self.chunk_size = chunk_size
 
     def load_pgm_chunked(self, file_path):
-        """Load PGM file in chunks to reduce memory usage."""
+        """Memory-map PGM pixel data so rows are paged in on demand."""
         # Read header
         with open(file_path, 'rb') as f:
             header = f.readline().decode('utf-8').strip()
@@ -36,48 +74,24 @@ class MemoryOptimizedConverter:
             width, height = map(int, line.split())
             max_value = int(f.readline().decode('utf-8').strip())
             header_offset = f.tell()
-            
-            # Pre-allocate array
-            heightmap = np.zeros((height, width), dtype=np.uint8)
-            
-            # Read data in chunks
-            for i in tqdm(range(0, height, self.chunk_size), desc="Loading PGM"):
-                chunk_height = min(self.chunk_size, height - i)
-                chunk_size = chunk_height * width
-                chunk_data = np.frombuffer(f.read(chunk_size), dtype=np.uint8)
-                heightmap[i:i+chunk_height] = chunk_data.reshape((chunk_height, width))
-            
-            return heightmap, max_value
-
-    def create_terrain_mesh(self, heightmap, scale_factor=1.0):
-        """Create terrain mesh with proper scaling and normals."""
-        height, width = heightmap.shape
-        
-        # Create vertex grid
-        x = np.linspace(-width/2, width/2, width) * scale_factor
-        y = np.linspace(-height/2, height/2, height) * scale_factor
-        X, Y = np.meshgrid(x, y)
-        
-        # Scale height values
-        Z = heightmap.astype(np.float32) * scale_factor
         
-        # Create vertices
-        vertices = np.zeros((width * height, 3))
-        vertices[:, 0] = X.flatten()
-        vertices[:, 2] = Y.flatten()  # Swap Y and Z for proper orientation
-        vertices[:, 1] = Z.flatten()  # Height becomes Y in 3D space
+        # Map the samples in place; 16-bit PGMs are big-endian
+        dtype = np.uint8 if max_value < 256 else np.dtype('>u2')
+        heightmap = np.memmap(file_path, dtype=dtype, mode='r', offset=header_offset, shape=(height, width))
         
-        # Create faces
-        faces = []
-        for i in range(height - 1):
-            for j in range(width - 1):
-                v0 = i * width + j
-                v1 = v0 + 1
-                v2 = (i + 1) * width + j
-                v3 = v2 + 1
-                faces.extend([[v0, v2, v1], [v1, v2, v3]])
+        # Convert 16-bit samples to native byte order in chunks of rows
+        if heightmap.dtype.byteorder == '>':
+            native = np.empty((height, width), dtype=np.uint16)
+            for i in tqdm(range(0, height, self.chunk_size), desc="Loading PGM"):
+                native[i:i+self.chunk_size] = heightmap[i:i+self.chunk_size]
+            heightmap = native
         
-        faces = np.array(faces)
+        return heightmap, max_value
+
+    def create_terrain_mesh(self, heightmap, scale_factor=1.0, max_value=1.0):
+        """Create terrain mesh with proper scaling and normals."""
+        # Vertices, faces and height normalization in one parallel pass
+        vertices, faces = build_mesh(np.asarray(heightmap), float(max_value), float(scale_factor))
         
         # Create mesh
         ms = ml.MeshSet()
@@ -95,24 +109,22 @@ class MemoryOptimizedConverter:
         logger.info(f"Initial faces: {current_faces}")
         
         if current_faces > target_faces:
-            # First cleaning pass
+            # Single cleaning pass before decimation
+            ms.meshing_remove_duplicate_vertices()
             ms.meshing_remove_unreferenced_vertices()
-            ms.meshing_repair_non_manifold_edges()
             
-            # Decimation with quality preservation
+            # Decimation with quality preservation; autoclean tidies up
+            # within the same pass, so no post-decimation cleanup is needed
             ms.meshing_decimation_quadric_edge_collapse(
                 targetfacenum=target_faces,
                 qualitythr=0.5,
                 preserveboundary=True,
                 preservenormal=True,
-                optimalplacement=True
+                optimalplacement=True,
+                planarquadric=True,
+                autoclean=True
             )
             
-            # Final cleaning
-            ms.meshing_repair_non_manifold_edges()
-            ms.meshing_remove_duplicate_faces()
-            ms.meshing_remove_duplicate_vertices()
-            
             logger.info(f"Optimized to {ms.current_mesh().face_number()} faces")
 
     def validate_glb(self, glb_path):
@@ -130,23 +142,23 @@ class MemoryOptimizedConverter:
             
             return True
 
-    def convert_to_glb(self, obj_path, glb_path):
-        """Convert OBJ to GLB using gltf-pipeline."""
+    def convert_to_glb(self, ms, glb_path):
+        """Export the current mesh to GLB and compress it using gltf-pipeline."""
         try:
-            # First convert to GLTF
-            temp_gltf = obj_path.with_suffix('.gltf')
-            
-            # Use obj2gltf for initial conversion
-            subprocess.run([
-                'obj2gltf',
-                '-i', str(obj_path),
-                '-o', str(temp_gltf)
-            ], check=True)
+            # Write an uncompressed GLB straight from the mesh arrays
+            temp_glb = glb_path.with_suffix('.raw.glb')
+            mesh = ms.current_mesh()
+            trimesh.Trimesh(
+                vertices=mesh.vertex_matrix().astype(np.float32),
+                faces=mesh.face_matrix().astype(np.uint32),
+                vertex_normals=mesh.vertex_normal_matrix().astype(np.float32),
+                process=False
+            ).export(temp_glb, include_normals=True)
             
             # Use gltf-pipeline for final conversion with Draco compression
             subprocess.run([
                 'gltf-pipeline',
-                '-i', str(temp_gltf),
+                '-i', str(temp_glb),
                 '-o', str(glb_path),
                 '--draco.compressionLevel', '7',
                 '--draco.quantizePositionBits', '14',
@@ -155,7 +167,7 @@ class MemoryOptimizedConverter:
             ], check=True)
             
             # Clean up temporary file
-            os.remove(temp_gltf)
+            os.remove(temp_glb)
             
             if not self.validate_glb(glb_path):
                 raise ValueError("Generated GLB file is invalid")
@@ -169,45 +181,39 @@ class MemoryOptimizedConverter:
             logger.error(f"Error during conversion: {e}")
             raise
 
-    def pgm_to_glb(self, pgm_path, obj_path, glb_path, target_width=1024, target_faces=500000):
-        """Convert PGM to GLB with validation."""
+    def pgm_to_glb(self, pgm_path, obj_path=None, glb_path=None, target_width=1024, target_faces=500000):
+        """Convert PGM to GLB with validation. obj_path is deprecated and ignored."""
+        if obj_path is not None:
+            logger.warning("pgm_to_glb: obj_path is deprecated and ignored; the GLB is exported directly")
+        if glb_path is None:
+            raise TypeError("pgm_to_glb() missing required argument: 'glb_path'")
         try:
             pgm_path = Path(pgm_path)
-            obj_path = Path(obj_path)
             glb_path = Path(glb_path)
             
             # Load heightmap
             logger.info("Loading heightmap...")
             heightmap, max_value = self.load_pgm_chunked(pgm_path)
             
-            # Normalize heightmap
-            heightmap = heightmap.astype(np.float32) / max_value
-            
             # Downsample if needed
             if heightmap.shape[1] > target_width:
                 scale = target_width / heightmap.shape[1]
                 new_height = int(heightmap.shape[0] * scale)
                 logger.info(f"Downsampling to {target_width}x{new_height}")
-                heightmap = zoom(heightmap, (scale, scale), order=1)
+                # zoom only prefilters for order > 1, so prefilter=False here is explicit, not a saving
+                heightmap = zoom(heightmap, (scale, scale), output=np.float32, order=1, prefilter=False)
             
-            # Create mesh
+            # Create mesh, normalizing heights by max_value
             logger.info("Creating terrain mesh...")
-            ms = self.create_terrain_mesh(heightmap, scale_factor=1.0)
+            ms = self.create_terrain_mesh(heightmap, scale_factor=1.0, max_value=max_value)
             
             # Optimize
             logger.info("Optimizing mesh...")
             self.optimize_mesh(ms, target_faces)
             
-            # Save OBJ
-            logger.info("Saving intermediate OBJ...")
-            ms.save_current_mesh(str(obj_path))
-            
             # Convert to GLB
             logger.info("Converting to GLB...")
-            self.convert_to_glb(obj_path, glb_path)
-            
-            # Cleanup
-            os.remove(obj_path)
+            self.convert_to_glb(ms, glb_path)
             
             logger.info("Conversion completed successfully!")
             return True
@@ -221,8 +227,7 @@ if __name__ == "__main__":
     try:
         converter.pgm_to_glb(
             'lat-30_lon000.pgm',
-            'mars.obj',
-            'crater.glb',
+            glb_path='crater.glb',
             target_width=2048,
             target_faces=750000
         )
@@ -1,100 +1,285 @@
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from matplotlib.figure import Figure
 import os
+import csv
+import math
 import logging
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+from numba import njit, prange
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Only these THEMIS columns are used by the comparison
+THEMIS_COLUMNS = ['diameter_km', 'depth_km']
+HIRISE_COLUMNS = ['diameter_m', 'depth_m']
+MM_COLUMNS = ['diameter_mm', 'depth_mm']
+
+# THEMIS crater sizes are held as int64 millimeters; these bound the valid values
+MISSING_MM = np.iinfo(np.int64).min
+MAX_MM = np.iinfo(np.int64).max
+
+def source_key(path):
+    """(size, mtime in ns) of a source file, used to tell whether data loaded from it is stale."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def to_millimeters(values, scale):
+    """Round sizes to int64 millimeters (scale converts from the source unit), marking NaNs as MISSING_MM."""
+    mm = np.rint(np.asarray(values, dtype=np.float64) * scale)
+    return np.where(np.isnan(mm), MISSING_MM, mm).astype(np.int64)
+
+@njit(parallel=True, cache=True)
+def reduce_column(values):
+    """Count, sum, min and max of the non-missing millimeter values in one parallel pass."""
+    count = 0
+    total = 0
+    low = MAX_MM
+    high = MISSING_MM
+    for i in prange(values.size):
+        x = values[i]
+        if x != MISSING_MM:
+            count += 1
+            total += x
+            low = min(low, x)
+            high = max(high, x)
+    return count, total, low, high
+
+@njit(parallel=True, cache=True)
+def reduce_float_column(values):
+    """Count, sum, min and max of the non-NaN values in one parallel pass."""
+    count = 0
+    total = 0.0
+    low = np.inf
+    high = -np.inf
+    for i in prange(values.size):
+        x = values[i]
+        if not np.isnan(x):
+            count += 1
+            total += x
+            low = min(low, x)
+            high = max(high, x)
+    return count, total, low, high
+
+# Compile for the int64 THEMIS and float64 HiRISE columns up front so the first real calls are warm
+reduce_column(np.zeros(4, dtype=np.int64))
+reduce_float_column(np.zeros(4, dtype=np.float64))
+
 class MarsCraterComparator:
-    def __init__(self, themis_dir='path/to/themis_csvs', hirise_csv='path/to/hirise_quarter_craters.csv', output_dir='path/to/output'):
+    # HiRISE area: 26 sub-mosaics, each 10x10 images (2270x2270 pixels), 0.25 m/pixel
+    HIRISE_AREA_KM2 = 26 * (2270 * 2270) * (0.25 ** 2) / 1e6
+
+    def __init__(self, themis_dir='path/to/themis_csvs', hirise_csv='path/to/hirise_quarter_craters.csv', output_dir='path/to/output',
+                 themis_tile_area_km2=100 * 100, cache_dir=None):
         self.themis_dir = themis_dir
         self.hirise_csv = hirise_csv
         self.output_dir = output_dir
-        self.themis_files = glob(os.path.join(themis_dir, 'themis_*_craters.csv'))
-        self.themis_dfs = []
-        self.hirise_df = None
+        # Parquet caches of the THEMIS CSVs; kept out of themis_dir, which may be read-only
+        self.cache_dir = cache_dir or os.path.join(output_dir, 'themis_cache')
+        # Estimated area per THEMIS tile (~100 km x 100 km by default, adjust if known)
+        self.themis_tile_area_km2 = themis_tile_area_km2
+        # Per-file (rows, 2) millimeter views into the arena, one per THEMIS CSV
+        self.themis_rows = []
+        # HiRISE crater sizes in meters, kept as plain float64 arrays at full precision
+        self.hirise_diameters = self.hirise_depths = None
+        
+        # File inventory and mtimes from the last scan/load, so repeated runs skip unchanged work
+        self._themis_dir_mtime = None
+        self._themis_files = []
+        self._themis_loaded = None
+        self._hirise_key = None
+        self._fig = self._ax = None
+        # Preallocated int64 (rows, 2) millimeter buffer reused by every THEMIS load
+        self._arena = None
         
         # Create output directory if it doesn’t exist
         os.makedirs(self.output_dir, exist_ok=True)
 
+    @property
+    def themis_files(self):
+        """THEMIS crater CSVs, re-globbed only when the directory has changed."""
+        try:
+            dir_mtime = os.stat(self.themis_dir).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if dir_mtime != self._themis_dir_mtime:
+            self._themis_files = glob(os.path.join(self.themis_dir, 'themis_*_craters.csv'))
+            self._themis_dir_mtime = dir_mtime
+        return self._themis_files
+
     def load_data(self):
         """Load THEMIS and HiRISE CSV data."""
         # Load THEMIS CSVs
-        if not self.themis_files:
+        themis_files = self.themis_files
+        if not themis_files:
             logger.warning(f"No THEMIS crater CSV files found in {self.themis_dir}")
+            self.themis_rows = []
+            self._themis_loaded = None
         else:
-            for file in self.themis_files:
-                df = pd.read_csv(file)
-                # Convert km to meters for consistency
-                df['diameter_m'] = df['diameter_km'] * 1000
-                df['depth_m'] = df['depth_km'] * 1000
-                self.themis_dfs.append(df)
-                logger.info(f"Loaded THEMIS data from {file}: {len(df)} craters")
+            themis_state = [(file, *source_key(file)) for file in themis_files]
+            if themis_state != self._themis_loaded:
+                # Parsing releases the GIL, so files are read concurrently
+                with ThreadPoolExecutor(max_workers=min(8, len(themis_files))) as executor:
+                    # Caches are refreshed first so the arena can be sized from row counts alone
+                    cached = list(executor.map(self.cache_themis_file, themis_files))
+                    row_counts = [n for _, n in cached]
+                    total_rows = sum(row_counts)
+                    # One arena holds every file's rows; keep the previous one if it is big enough
+                    if self._arena is None or len(self._arena) < total_rows:
+                        # Column-major so each column is contiguous for the reductions
+                        self._arena = np.empty((total_rows, 2), dtype=np.int64, order='F')
+                    offsets = np.cumsum([0] + row_counts[:-1]).tolist()
+                    slices = [self._arena[offset:offset + n] for offset, n in zip(offsets, row_counts)]
+                    list(executor.map(self.load_themis_file, themis_files, [path for path, _ in cached], slices))
+                self.themis_rows = slices
+                self._themis_loaded = themis_state
         
         # Load HiRISE CSV
-        if os.path.exists(self.hirise_csv):
-            self.hirise_df = pd.read_csv(self.hirise_csv)
-            logger.info(f"Loaded HiRISE data from {self.hirise_csv}: {len(self.hirise_df)} craters")
-        else:
+        try:
+            hirise_key = source_key(self.hirise_csv)
+        except FileNotFoundError:
             logger.warning(f"HiRISE file not found: {self.hirise_csv}")
+            self.hirise_diameters = self.hirise_depths = None
+            self._hirise_key = None
+        else:
+            if hirise_key != self._hirise_key:
+                convert_options = pv.ConvertOptions(
+                    include_columns=HIRISE_COLUMNS,
+                    column_types={column: pa.float64() for column in HIRISE_COLUMNS}
+                )
+                table = pv.read_csv(self.hirise_csv, convert_options=convert_options)
+                self.hirise_diameters = table.column('diameter_m').to_numpy()
+                self.hirise_depths = table.column('depth_m').to_numpy()
+                self._hirise_key = hirise_key
+                logger.info(f"Loaded HiRISE data from {self.hirise_csv}: {table.num_rows} craters")
+
+    def cache_themis_file(self, file):
+        """Make sure a THEMIS CSV's Parquet cache matches it; returns (cache path or None if unwritable, row count)."""
+        size, mtime_ns = source_key(file)
+        # The cache records the CSV it was built from and is only used on an exact match
+        metadata = {b'source_size': str(size).encode(), b'source_mtime_ns': str(mtime_ns).encode()}
+        parquet_file = os.path.join(self.cache_dir, os.path.splitext(os.path.basename(file))[0] + '.mm.parquet')
+        try:
+            parquet_metadata = pq.read_metadata(parquet_file)
+        except (OSError, pa.ArrowInvalid):
+            parquet_metadata = None
+        if parquet_metadata is not None:
+            cached = parquet_metadata.metadata or {}
+            if all(cached.get(key) == value for key, value in metadata.items()):
+                return parquet_file, parquet_metadata.num_rows
+        
+        table = self.convert_themis_csv(file)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            pq.write_table(table.replace_schema_metadata(metadata), parquet_file, compression='zstd')
+        except OSError as e:
+            logger.warning(f"Could not cache {file} as {parquet_file}, using the CSV directly: {e}")
+            return None, table.num_rows
+        logger.info(f"Cached {file} as {parquet_file}")
+        return parquet_file, table.num_rows
+
+    def load_themis_file(self, file, parquet_file, out):
+        """Copy one THEMIS file's crater sizes in millimeters into its arena rows, from its cache when it has one."""
+        table = pq.read_table(parquet_file, columns=MM_COLUMNS) if parquet_file else self.convert_themis_csv(file)
+        for i, column in enumerate(table.itercolumns()):
+            np.copyto(out[:, i], column.to_numpy())
+        logger.info(f"Loaded THEMIS data from {file}: {table.num_rows} craters")
 
-    def compute_stats(self, df, prefix, area_km2=None):
-        """Compute basic stats for a DataFrame."""
-        stats = {
-            f'{prefix}_total_craters': len(df),
-            f'{prefix}_mean_diameter_m': df['diameter_m'].mean() if not df.empty else 0,
-            f'{prefix}_median_diameter_m': df['diameter_m'].median() if not df.empty else 0,
-            f'{prefix}_min_diameter_m': df['diameter_m'].min() if not df.empty else 0,
-            f'{prefix}_max_diameter_m': df['diameter_m'].max() if not df.empty else 0,
-            f'{prefix}_mean_depth_m': df['depth_m'].mean() if not df.empty else 0,
-            f'{prefix}_median_depth_m': df['depth_m'].median() if not df.empty else 0,
-            f'{prefix}_min_depth_m': df['depth_m'].min() if not df.empty else 0,
-            f'{prefix}_max_depth_m': df['depth_m'].max() if not df.empty else 0,
-        }
+    def convert_themis_csv(self, file):
+        """Read a THEMIS CSV's crater sizes as an int64 millimeter table."""
+        convert_options = pv.ConvertOptions(
+            include_columns=THEMIS_COLUMNS,
+            column_types={column: pa.float64() for column in THEMIS_COLUMNS}
+        )
+        table = pv.read_csv(file, convert_options=convert_options)
+        # Convert km to integer millimeters
+        return pa.table({
+            mm_column: to_millimeters(table.column(km_column).to_numpy(), 1_000_000)
+            for km_column, mm_column in zip(THEMIS_COLUMNS, MM_COLUMNS)
+        })
+
+    def compute_stats(self, diameters, depths, prefix, area_km2=None):
+        """Compute stats in meters over diameter and depth arrays, each one array or a list of per-file arrays.
+
+        Integer arrays are millimeters with MISSING_MM gaps; float arrays are meters with NaN gaps.
+        """
+        if isinstance(diameters, np.ndarray):
+            diameters, depths = [diameters], [depths]
+        total_craters = sum(len(values) for values in diameters)
+        stats = {f'{prefix}_total_craters': total_craters}
+        for column, pieces in [('diameter_m', diameters), ('depth_m', depths)]:
+            arrays = [values for values in pieces if values.size]
+            if not arrays:
+                mean = median = low = high = 0.0
+            else:
+                integer = arrays[0].dtype.kind == 'i'
+                reduce, scale = (reduce_column, 1000) if integer else (reduce_float_column, 1)
+                # Reduce each file on its own, then combine the (count, sum, min, max) partials
+                counts, totals, lows, highs = zip(*(reduce(values) for values in arrays))
+                count = sum(counts)
+                if count == 0:
+                    # Every value is missing; report NaN as pandas' reductions did
+                    mean = median = low = high = np.nan
+                else:
+                    mean = sum(totals) / count / scale
+                    low = min(lows) / scale
+                    high = max(highs) / scale
+                    # The median needs every value, so join only this column's arrays
+                    values = np.concatenate(arrays)
+                    valid = values != MISSING_MM if integer else ~np.isnan(values)
+                    median = np.median(values[valid]) / scale
+            stats.update({
+                f'{prefix}_mean_{column}': float(mean),
+                f'{prefix}_median_{column}': float(median),
+                f'{prefix}_min_{column}': float(low),
+                f'{prefix}_max_{column}': float(high),
+            })
         if area_km2:
-            stats[f'{prefix}_crater_density_km2'] = len(df) / area_km2 if area_km2 > 0 else 0
+            stats[f'{prefix}_crater_density_km2'] = total_craters / area_km2 if area_km2 > 0 else 0
         return stats
 
     def aggregate_and_compare(self):
         """Aggregate stats and compare THEMIS vs HiRISE."""
-        if not self.themis_dfs and self.hirise_df is None:
+        if not self.themis_rows and self.hirise_diameters is None:
             logger.error("No data loaded for comparison")
             return None, None, None
 
-        # Combine THEMIS data
-        if self.themis_dfs:
-            themis_combined = pd.concat(self.themis_dfs, ignore_index=True)
-            # Estimate area (assuming each THEMIS tile is ~100 km x 100 km, adjust if known)
-            themis_area_km2 = len(self.themis_files) * 100 * 100  # Rough estimate
-            themis_stats = self.compute_stats(themis_combined, 'themis', themis_area_km2)
+        # THEMIS stats, streamed across the per-file arena rows
+        if self.themis_rows:
+            themis_area_km2 = len(self.themis_files) * self.themis_tile_area_km2  # Rough estimate
+            themis_stats = self.compute_stats([rows[:, 0] for rows in self.themis_rows],
+                                              [rows[:, 1] for rows in self.themis_rows],
+                                              'themis', themis_area_km2)
         else:
             themis_stats = {f'themis_{k}': 0 for k in ['total_craters', 'mean_diameter_m', 'median_diameter_m', 
                                                       'min_diameter_m', 'max_diameter_m', 'mean_depth_m', 
                                                       'median_depth_m', 'min_depth_m', 'max_depth_m', 'crater_density_km2']}
-            themis_combined = pd.DataFrame()
 
         # HiRISE stats
-        if self.hirise_df is not None:
-            # Area: 26 sub-mosaics, each 10x10 images (2270x2270 pixels), 0.25 m/pixel
-            hirise_area_m2 = 26 * (2270 * 2270) * (0.25 ** 2)  # m²
-            hirise_area_km2 = hirise_area_m2 / 1e6  # km²
-            hirise_stats = self.compute_stats(self.hirise_df, 'hirise', hirise_area_km2)
+        if self.hirise_diameters is not None:
+            hirise_stats = self.compute_stats(self.hirise_diameters, self.hirise_depths, 'hirise', self.HIRISE_AREA_KM2)
         else:
             hirise_stats = {f'hirise_{k}': 0 for k in ['total_craters', 'mean_diameter_m', 'median_diameter_m', 
                                                       'min_diameter_m', 'max_diameter_m', 'mean_depth_m', 
                                                       'median_depth_m', 'min_depth_m', 'max_depth_m', 'crater_density_km2']}
-            hirise_combined = pd.DataFrame()
 
         # Comparison
+        compared = ['total_craters', 'mean_diameter_m', 'median_diameter_m', 'mean_depth_m', 'crater_density_km2']
+        t_vals = np.array([themis_stats.get(f'themis_{stat}', 0) for stat in compared], dtype=np.float64)
+        h_vals = np.array([hirise_stats.get(f'hirise_{stat}', 0) for stat in compared], dtype=np.float64)
+        diffs = h_vals - t_vals  # HiRISE - THEMIS
+        ratios = np.divide(h_vals, t_vals, out=np.full_like(h_vals, np.inf), where=t_vals != 0)
+        
         comparison = {}
-        for stat in ['total_craters', 'mean_diameter_m', 'median_diameter_m', 'mean_depth_m', 'crater_density_km2']:
-            t_val = themis_stats.get(f'themis_{stat}', 0)
-            h_val = hirise_stats.get(f'hirise_{stat}', 0)
-            comparison[f'{stat}_diff_m'] = h_val - t_val  # HiRISE - THEMIS
-            comparison[f'{stat}_ratio'] = h_val / t_val if t_val != 0 else float('inf')
+        for stat, diff, ratio in zip(compared, diffs.tolist(), ratios.tolist()):
+            comparison[f'{stat}_diff_m'] = diff
+            comparison[f'{stat}_ratio'] = ratio
+        # Crater counts are integers, so keep their difference one in the log and CSV
+        comparison['total_craters_diff_m'] = int(comparison['total_craters_diff_m'])
 
         return themis_stats, hirise_stats, comparison
 
@@ -107,7 +292,13 @@ class MarsCraterComparator:
         x = np.arange(len(stats_to_plot))
         width = 0.35
 
-        fig, ax = plt.subplots(figsize=(10, 6))
+        # Build the figure once and clear it on later runs; it is not registered with
+        # pyplot, so it renders with Agg and is freed along with the comparator
+        if self._fig is None:
+            self._fig = Figure(figsize=(10, 6))
+            self._ax = self._fig.subplots()
+        fig, ax = self._fig, self._ax
+        ax.clear()
         ax.bar(x - width/2, themis_vals, width, label='THEMIS', color='blue', alpha=0.7)
         ax.bar(x + width/2, hirise_vals, width, label='HiRISE', color='orange', alpha=0.7)
         
@@ -123,11 +314,11 @@ class MarsCraterComparator:
             ax.text(i, max(themis_vals[i], hirise_vals[i]) + 0.05 * max(themis_vals + hirise_vals), 
                     f'Diff: {diff:.2f}', ha='center', fontsize=8)
         
-        plt.tight_layout()
+        fig.tight_layout()
         output_path = os.path.join(self.output_dir, 'crater_stats_comparison.png')
-        fig.savefig(output_path, dpi=100)
+        # Favor fast PNG encoding over the smallest file
+        fig.savefig(output_path, dpi=100, format='png', pil_kwargs={'optimize': False, 'compress_level': 1})
         logger.info(f"Saved comparison plot to {output_path}")
-        plt.close(fig)
 
     def run_analysis(self):
         """Run the full comparison pipeline."""
@@ -135,18 +326,16 @@ class MarsCraterComparator:
         themis_stats, hirise_stats, comparison = self.aggregate_and_compare()
         
         if themis_stats and hirise_stats:
-            # Log stats
-            logger.info("\nTHEMIS Combined Stats:")
-            for key, value in themis_stats.items():
-                logger.info(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
-            
-            logger.info("\nHiRISE Combined Stats:")
-            for key, value in hirise_stats.items():
-                logger.info(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
-            
-            logger.info("\nComparison (HiRISE - THEMIS):")
-            for key, value in comparison.items():
-                logger.info(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+            # Log stats as a single record
+            if logger.isEnabledFor(logging.INFO):
+                lines = []
+                for title, stats in [("THEMIS Combined Stats", themis_stats),
+                                     ("HiRISE Combined Stats", hirise_stats),
+                                     ("Comparison (HiRISE - THEMIS)", comparison)]:
+                    lines.append(f"\n{title}:")
+                    lines.extend(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}"
+                                 for key, value in stats.items())
+                logger.info("\n".join(lines))
             
             # Visualize
             self.visualize_comparison(themis_stats, hirise_stats, comparison)
@@ -154,7 +343,13 @@ class MarsCraterComparator:
             # Save combined stats
             combined_stats = {**themis_stats, **hirise_stats, **comparison}
             output_csv = os.path.join(self.output_dir, 'crater_comparison_stats.csv')
-            pd.DataFrame([combined_stats]).to_csv(output_csv, index=False)
+            # A single row, so write it directly rather than through a DataFrame
+            with open(output_csv, 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerow(combined_stats.keys())
+                # Missing stats stay empty fields, as DataFrame.to_csv wrote them
+                writer.writerow(['' if isinstance(value, float) and math.isnan(value) else value
+                                 for value in combined_stats.values()])
             logger.info(f"Saved comparison stats to {output_csv}")
         
         return themis_stats, hirise_stats, comparison